@@ -6,6 +6,10 @@ ROOT_DIR = str(Path(__file__).parent)
 if not 'cat_gender_detector' in ROOT_DIR:
     ROOT_DIR = str(Path(ROOT_DIR) / 'cat_gender_detector')
 EXCEPTIONS_FILE_NAME = str(Path(ROOT_DIR) / "object_detection" / "image_processing_exceptions.log")
+DATA_DIR = Path(ROOT_DIR).parent / "data"
+TEXTS_DIR = DATA_DIR / "texts"
+IMAGES_DIR = DATA_DIR / "images"
+LABELS_DIR = DATA_DIR / "labels"
 MODEL_PATH = str(Path(ROOT_DIR) / "yolov10b.pt")
 TRAIN_IMAGE_FORMAT = '.png'
 POSTS_TO_PARSE = 2000
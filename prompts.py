@@ -44,3 +44,43 @@ def get_text_classifier_prompt(language: str) -> str:
     return RUSSIAN_TEXT_CLASSIFIER_PROMPT
 
 
+RUSSIAN_MULTI_POST_CLASSIFIER_PROMPT = (
+    """
+You are an expert in Russian language. Сообщение пользователя содержит несколько пронумерованных постов на русском языке ("### Post 1", "### Post 2", ...). Для каждого поста независимо определи пол кота, который является его главным субъектом.
+
+Правила принятия решения для каждого поста:
+- Если в тексте используются мужские индикаторы (например: он, его, ему, кот, мальчик, хороший мальчик, рыжик, красавчик), метка "MALE CAT".
+- Если используются женские индикаторы (например: она, её, ей, кошка, девочка, хорошая девочка, красавица, королева), метка "FEMALE CAT".
+- Если речь о нескольких котах, о котятах без одного явного субъекта или нет признаков пола, метка "OTHER".
+
+Правила формата ответа:
+- Верни ТОЛЬКО JSON-массив с одной меткой на пост в том же порядке, например ["MALE CAT", "OTHER", "FEMALE CAT"].
+- Каждая метка — РОВНО одно из: "MALE CAT", "FEMALE CAT", "OTHER". Без пояснений.
+"""
+    .strip()
+)
+
+
+ENGLISH_MULTI_POST_CLASSIFIER_PROMPT = (
+    """
+You are an expert in English language. The user's message contains several numbered posts in English ("### Post 1", "### Post 2", ...). For each post independently, determine the gender of the cat that is its main subject.
+
+Decision rules for each post:
+- If the text uses male indicators (e.g., he, him, his, boy, boi, tom, king, sir, good boy, handsome boy), label it "MALE CAT".
+- If the text uses female indicators (e.g., she, her, hers, girl, queen, lady, good girl, pretty girl), label it "FEMALE CAT".
+- If the text refers to multiple cats, mentions kittens without a clear single subject, or contains no gender clues, label it "OTHER".
+
+Output policy:
+- Output ONLY a JSON array with one label per post, in the same order, e.g. ["MALE CAT", "OTHER", "FEMALE CAT"].
+- Every label is EXACTLY one of: "MALE CAT", "FEMALE CAT", "OTHER". No explanations.
+"""
+    .strip()
+)
+
+
+def get_multi_post_classifier_prompt(language: str) -> str:
+    """Return the system prompt for classifying several numbered posts in one request."""
+    lang = (language or "ru").lower()
+    if lang in {"en", "eng", "english"}:
+        return ENGLISH_MULTI_POST_CLASSIFIER_PROMPT
+    return RUSSIAN_MULTI_POST_CLASSIFIER_PROMPT
@@ -1,25 +1,56 @@
 import os
 import time
+import queue
+import multiprocessing
 from pathlib import Path
 from definitions import ROOT_DIR
 
-from training.etl.run_training_pipeline import run_etl_pipeline
-from training.run_training_pipeline import run_training_pipeline
+from run_etl import run_etl
+from training.etl.run_training_pipeline import run_training_pipeline
 
 def run_complete_pipeline():
     start_time = time.time()
+
+    # Start the training process right away: it loads the YOLO model while ETL is running
+    # and starts training as soon as the dataset is organized
+    mp_context = multiprocessing.get_context("spawn")
+    dataset_ready = mp_context.Event()
+    training_results = mp_context.Queue()
+    training_process = mp_context.Process(target=run_training_pipeline,
+                                          kwargs={"dataset_ready": dataset_ready, "result_queue": training_results})
+    training_process.start()
     
     # Step 1: Run ETL pipeline
     print("=" * 50)
     print("STEP 1: Running ETL Pipeline")
     print("=" * 50)
-    etl_stats = run_etl_pipeline()
+    try:
+        etl_stats = run_etl()
+    except BaseException:
+        training_process.terminate()
+        raise
+    dataset_ready.set()
     
     # Step 2: Run training pipeline
     print("\n" + "=" * 50)
     print("STEP 2: Running Training Pipeline")
     print("=" * 50)
-    model_path = run_training_pipeline()
+    # Drain the queue before joining: a child blocked on flushing its queue never exits
+    model_path = None
+    while model_path is None:
+        try:
+            model_path = training_results.get(timeout=5)
+        except queue.Empty:
+            if not training_process.is_alive():
+                # One last look: the result may have been flushed right before the child exited
+                try:
+                    model_path = training_results.get(timeout=1)
+                except queue.Empty:
+                    pass
+                break
+    training_process.join()
+    if training_process.exitcode != 0 or model_path is None:
+        raise RuntimeError(f"Training process failed with exit code {training_process.exitcode}")
     
     # Print summary
     total_time = time.time() - start_time
@@ -31,4 +62,4 @@ def run_complete_pipeline():
     print(f"Trained model saved to: {model_path}")
 
 if __name__ == "__main__":
-    run_complete_pipeline() 
\ No newline at end of file
+    run_complete_pipeline() 
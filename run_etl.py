@@ -1,4 +1,5 @@
 import os
+import asyncio
 import dotenv
 from pathlib import Path
 
@@ -30,6 +31,12 @@ def run_etl():
     reddit_password = os.getenv('REDDIT_PASSWORD')
 
     if source == 'telegram':
+        # Must be set before the client is created: Telethon binds to the loop of the current policy
+        try:
+            import uvloop
+            asyncio.set_event_loop_policy(uvloop.EventLoopPolicy())
+        except ImportError:
+            pass
         post_parser = TelegramPostParser(
             login='',
             password='',
@@ -76,6 +83,7 @@ def run_etl():
     
     print("ETL pipeline completed successfully!")
     print(f"Dataset statistics: {stats}")
+    return stats
 
 
 if __name__ == "__main__":
@@ -1,9 +1,8 @@
 import os
 import shutil
 from pathlib import Path
-from glob import glob
 import random
-from definitions import ROOT_DIR, TRAIN_IMAGE_FORMAT
+from definitions import ROOT_DIR, DATA_DIR, TRAIN_IMAGE_FORMAT
 
 
 class DatasetManager:
@@ -12,25 +11,22 @@ class DatasetManager:
         self.val_size = val_size
         self.test_size = test_size
         self.image_format = image_format
-        self.data_path = Path(ROOT_DIR).parent / 'data'
+        self.data_path = DATA_DIR
         self.train_path = Path(ROOT_DIR).parent / 'train'
         self.val_path = Path(ROOT_DIR).parent / 'valid'
         self.test_path = Path(ROOT_DIR).parent / 'test'
-        
-        for path in [self.train_path, self.val_path, self.test_path]:
-            os.makedirs(path / 'images', exist_ok=True)
-            os.makedirs(path / 'labels', exist_ok=True)
     
     def get_labeled_image_paths(self):
         """Get paths of all images that have corresponding label files"""
         label_root = str(self.data_path / 'labels')
         image_root = str(self.data_path / 'images')
         
-        label_files = [Path(elem).stem for elem in glob(label_root + '/*.txt')]
-        image_files = [Path(elem).stem for elem in glob(image_root + f'/*.{self.image_format}')]
-        
+        label_files = {entry.name[:-len('.txt')] for entry in os.scandir(label_root) if entry.name.endswith('.txt')}
+        image_files = {entry.name[:-len(self.image_format)] for entry in os.scandir(image_root)
+                       if entry.name.endswith(self.image_format)}
+
         # Find images that have labels
-        labeled_images = list(set(image_files).intersection(set(label_files)))
+        labeled_images = list(image_files & label_files)
         return labeled_images
     
     def split_dataset(self):
@@ -51,39 +47,35 @@ class DatasetManager:
             'test': test_images
         }
     
+    @staticmethod
+    def _link_or_copy(src: str, dst: str) -> None:
+        try:
+            os.link(src, dst)
+        except FileNotFoundError:
+            return
+        except OSError:
+            shutil.copy(src, dst)
+
     def organize_dataset(self):
         """Organize the dataset into train, validation and test directories"""
         split_data = self.split_dataset()
         
-        # Clear existing files in train/val/test directories
+        # Recreate empty train/val/test directories
         for path in [self.train_path, self.val_path, self.test_path]:
-            for file in glob(str(path / 'images' / '*')):
-                os.remove(file)
-            for file in glob(str(path / 'labels' / '*')):
-                os.remove(file)
+            shutil.rmtree(path, ignore_errors=True)
+            (path / 'images').mkdir(parents=True)
+            (path / 'labels').mkdir(parents=True)
         
-        # Copy files to their respective directories
+        # Hardlink files into their respective directories (falls back to copying across filesystems)
+        data_root = str(self.data_path)
         for split_name, image_list in split_data.items():
-            target_path = getattr(self, f"{split_name}_path")
-            
+            target_root = str(getattr(self, f"{split_name}_path"))
             for image_name in image_list:
-                # Copy image
-                src_img = self.data_path / 'images' / f"{image_name}.{self.image_format}"
-                dst_img = target_path / 'images' / f"{image_name}.{self.image_format}"
-                if src_img.exists():
-                    shutil.copy(str(src_img), str(dst_img))
+                image_file_name = f"{image_name}{self.image_format}"
+                self._link_or_copy(f"{data_root}/images/{image_file_name}", f"{target_root}/images/{image_file_name}")
+                self._link_or_copy(f"{data_root}/labels/{image_name}.txt", f"{target_root}/labels/{image_name}.txt")
 
-                src_label = self.data_path / 'labels' / f"{image_name}.txt"
-                dst_label = target_path / 'labels' / f"{image_name}.txt"
-                if src_label.exists():
-                    shutil.copy(str(src_label), str(dst_label))
-        
-        # Return statistics
-        return {
-            'train': len(split_data['train']),
-            'val': len(split_data['val']),
-            'test': len(split_data['test'])
-        }
+        return {split_name: len(image_list) for split_name, image_list in split_data.items()}
     
     def generate_data_yaml(self):
         """Generate data.yaml file for YOLOv10 training"""
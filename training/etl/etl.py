@@ -1,111 +1,282 @@
 import os
-import re
+import csv
 import json
 import time
-import pandas as pd
+import asyncio
 from glob import glob
 from pathlib import Path
-from tqdm import tqdm
 from collections import defaultdict
+from typing import TYPE_CHECKING, Optional
 
-from definitions import ROOT_DIR, EXCEPTIONS_FILE_NAME, TRAIN_IMAGE_FORMAT
-from training.etl.training_description_classifier import DescriptionClassifier
-from training.etl.training_image_processor import TrainingImageProcessor
+from definitions import DATA_DIR, EXCEPTIONS_FILE_NAME, TRAIN_IMAGE_FORMAT
 from training.etl.dataset_manager import DatasetManager
+from training.etl.rate_limiter import RateLimiter
+
+if TYPE_CHECKING:
+    # Only needed for annotations; importing them pulls in langfuse and ultralytics/torch
+    from training.etl.training_description_classifier import DescriptionClassifier
+    from training.etl.training_image_processor import TrainingImageProcessor
 
 
 class ETL:
-    def __init__(self, description_classifier: DescriptionClassifier, 
-                 train_image_processor: TrainingImageProcessor,
+    def __init__(self, description_classifier: 'DescriptionClassifier',
+                 train_image_processor: 'TrainingImageProcessor',
                  dataset_manager: DatasetManager = None,
                  post_parser: object | None = None):
         self.description_classifier = description_classifier
         self.train_image_processor = train_image_processor
         self.dataset_manager = dataset_manager or DatasetManager(image_format=TRAIN_IMAGE_FORMAT)
         self.post_parser = post_parser
+        # Attempts per LLM request on transient errors; RPM/TPM/concurrency limits come from RateLimiter.from_env
+        self.llm_max_attempts = 4
+        # Number of images labeled per YOLO forward pass
+        self.yolo_batch_size = int(os.getenv('YOLO_BATCH_SIZE', '16'))
+        # Number of posts packed into a single chat completion request
+        self.llm_posts_per_request = int(os.getenv('LLM_POSTS_PER_REQUEST', '16'))
+        # Offline classification through the provider Batch API (OpenAI only)
+        self.use_batch_api = os.getenv('LLM_USE_BATCH_API', '').lower() in {'1', 'true', 'yes'}
 
         self.classes_log_name = "image_processing_log.csv"
         if os.path.exists(self.classes_log_name) and os.path.getsize(self.classes_log_name) > 0:
             try:
-                log_df = pd.read_csv(self.classes_log_name)
-                self.classes_log = log_df.to_dict(orient='records')
-            except Exception:
-                # Corrupt or unreadable file: start fresh
+                with open(self.classes_log_name, newline='', encoding='utf-8') as f:
+                    reader = csv.DictReader(f)
+                    self.classes_log = list(reader)
+                if not {'text_path', 'class_name'} <= set(reader.fieldnames or []):
+                    raise ValueError(f"Unexpected columns in {self.classes_log_name}: {reader.fieldnames}")
+            except Exception as e:
+                # Corrupt or unreadable file: keep it aside for inspection and start a fresh log
                 self.classes_log = []
+                corrupt_log_name = f"{self.classes_log_name}.{int(time.time())}.corrupt"
+                os.replace(self.classes_log_name, corrupt_log_name)
+                print(f"Could not read {self.classes_log_name} ({e}); moved it to {corrupt_log_name}")
         else:
             self.classes_log = []
+        # Rows already persisted in the log file; only rows after this cursor are appended on flush
+        self._flushed_log_rows = len(self.classes_log)
+        # Labels from previous runs, so resumed runs only send new texts to the LLM
+        self._already_classified = {row['text_path']: row['class_name'] for row in self.classes_log}
 
         self.exceptions_file_name = EXCEPTIONS_FILE_NAME
 
         # Ensure data directories exist
-        data_path = Path(ROOT_DIR).parent / 'data'
+        data_path = DATA_DIR
         for subdir in ['texts', 'images', 'labels']:
             os.makedirs(data_path / subdir, exist_ok=True)
 
-    def image_path_to_text_path(self, image_path):
-        text_path = image_path.replace('images', 'texts').replace(self.dataset_manager.image_format, '.txt')
-        text_path = re.sub(r'_\d+', '', text_path)
-        return text_path
-
-    def get_correct_class_name(self, text_path: str):
+    @staticmethod
+    def image_path_to_text_path(image_path):
+        # <data>/images/<post_id>_<idx>.png (or <data>/labels/<post_id>_<idx>.txt) -> <data>/texts/<post_id>.txt
+        directory, file_name = os.path.split(image_path)
+        stem = file_name.rpartition('.')[0] or file_name
+        post_id, sep, idx = stem.rpartition('_')
+        if sep and idx.isdigit():
+            stem = post_id
+        return f"{os.path.dirname(directory)}/texts/{stem}.txt"
+
+    async def get_correct_class_names(self, text_paths: list[str], rate_limiter: RateLimiter,
+                                      rate_limit_delay=0.5) -> list[Optional[str]]:
+        """
+        Classify several texts with a single LLM request, reusing labels from previous runs.
+        If the multi-post request fails, the chunk is classified text by text, so one bad reply or file
+        does not cost the whole chunk. None marks texts that could not be read or classified.
+        """
+        class_names: dict[str, Optional[str]] = {t_path: self._already_classified[t_path]
+                                                 for t_path in text_paths if t_path in self._already_classified}
+        texts = {}
+        for text_path in text_paths:
+            if text_path in class_names:
+                continue
+            try:
+                with open(text_path, 'r', encoding='utf-8') as f:
+                    texts[text_path] = f.read()
+            except OSError as e:
+                self.log_text_exception(text_path, e)
+                class_names[text_path] = None
+
+        to_classify = list(texts)
+        if len(to_classify) > 1:
+            try:
+                classified = zip(to_classify, await self.description_classifier.classify_with_limits(
+                    [texts[t_path] for t_path in to_classify], rate_limiter, self.llm_max_attempts, rate_limit_delay))
+            except Exception as e:
+                print(f"Multi-post classification failed ({e}), classifying {len(to_classify)} texts one by one")
+                classified = zip(to_classify, await asyncio.gather(*[
+                    self.classify_single_text(t_path, texts[t_path], rate_limiter, rate_limit_delay)
+                    for t_path in to_classify]))
+        else:
+            classified = [(t_path, await self.classify_single_text(t_path, texts[t_path], rate_limiter,
+                                                                   rate_limit_delay))
+                          for t_path in to_classify]
+
+        for text_path, class_name in classified:
+            if class_name is not None:
+                self.log_classification(text_path, class_name)
+            class_names[text_path] = class_name
+        return [class_names[t_path] for t_path in text_paths]
+
+    async def classify_single_text(self, text_path: str, text: str, rate_limiter: RateLimiter,
+                                   rate_limit_delay=0.5) -> Optional[str]:
         try:
-            with open(text_path, 'r', encoding='utf-8') as f:
-                text = f.read()
-            correct_class_name = self.description_classifier.classify_description(text)
-            print(f"Correct class name: {correct_class_name}")
-
-            # Log the classification
-            self.classes_log.append({
-                'text_path': text_path,
-                'class_name': correct_class_name,
-                'timestamp': time.strftime('%Y-%m-%d %H:%M:%S')
-            })
-
-            return correct_class_name
+            return (await self.description_classifier.classify_with_limits([text], rate_limiter, self.llm_max_attempts,
+                                                                           rate_limit_delay))[0]
         except Exception as e:
-            if not os.path.exists(self.exceptions_file_name):
-                os.makedirs(os.path.dirname(self.exceptions_file_name), exist_ok=True)
-            with open(self.exceptions_file_name, 'a') as f:
-                f.write(f"Text path: {text_path}. Error: {str(e)}\n")
-            return "OTHER"  # Default to OTHER in case of error
-
-    def process_training_post(self, text_file_path: str, processed_text_file_names: list[str],
-                              images_path: str) -> tuple[bool, str]:
-        if Path(text_file_path).name in processed_text_file_names:
-            return False, "processed"
-
-        description_class_name = self.get_correct_class_name(text_file_path)
-        description_class_id = self.description_classifier.get_class_id(description_class_name)
+            self.log_text_exception(text_path, e)
+            return None
+
+    def log_classification(self, text_path: str, class_name: str):
+        print(f"Correct class name: {class_name}")
+        self.classes_log.append({
+            'text_path': text_path,
+            'class_name': class_name,
+            'timestamp': time.strftime('%Y-%m-%d %H:%M:%S')
+        })
+        self._already_classified[text_path] = class_name
+
+    def flush_classes_log(self):
+        """Append classification rows logged since the previous flush to the CSV log"""
+        new_rows = self.classes_log[self._flushed_log_rows:]
+        if not new_rows:
+            return
+        write_header = not os.path.exists(self.classes_log_name) or os.path.getsize(self.classes_log_name) == 0
+        with open(self.classes_log_name, 'a', newline='', encoding='utf-8') as f:
+            writer = csv.DictWriter(f, fieldnames=['text_path', 'class_name', 'timestamp'])
+            if write_header:
+                writer.writeheader()
+            writer.writerows(new_rows)
+        self._flushed_log_rows = len(self.classes_log)
+
+    def log_text_exception(self, text_path: str, error):
+        if not os.path.exists(self.exceptions_file_name):
+            os.makedirs(os.path.dirname(self.exceptions_file_name), exist_ok=True)
+        with open(self.exceptions_file_name, 'a') as f:
+            f.write(f"Text path: {text_path}. Error: {str(error)}\n")
+
+    def classify_with_batch_api(self, text_file_paths: list[str]) -> dict[str, Optional[str]]:
+        """Classify all texts with a single Batch API job and return text path -> class name (None on failure)"""
+        class_names = {t_path: self._already_classified[t_path]
+                       for t_path in text_file_paths if t_path in self._already_classified}
+        to_classify = [t_path for t_path in text_file_paths if t_path not in class_names]
+        texts = []
+        for t_path in to_classify:
+            with open(t_path, 'r', encoding='utf-8') as f:
+                texts.append(f.read())
+
+        for t_path, class_name in zip(to_classify, self.description_classifier.classify_batch(texts)):
+            if class_name is None:
+                self.log_text_exception(t_path, "Batch API returned no result")
+            else:
+                self.log_classification(t_path, class_name)
+            class_names[t_path] = class_name
+        self.flush_classes_log()
+        return class_names
+
+    async def classify_posts_chunk(self, text_file_paths: list[str], classified_posts: asyncio.Queue,
+                                   rate_limiter: RateLimiter, rate_limit_delay=0.5):
+        description_class_names = await self.get_correct_class_names(text_file_paths, rate_limiter, rate_limit_delay)
+        # Persist labels as chunks complete, so a failure later in the run does not lose paid-for classifications
+        self.flush_classes_log()
+        for t_path, class_name in zip(text_file_paths, description_class_names):
+            await classified_posts.put((t_path, class_name))
+
+    async def consume_classified_posts(self, classified_posts: asyncio.Queue,
+                                       images_by_post: dict[str, list[str]]) -> dict[str, tuple[bool, str]]:
+        """
+        Collect images of classified posts and label them with batched YOLO inference
+        (yolo_batch_size images per forward pass, mixed classes), off the event loop.
+        """
+        results = {}
+        pending_images: list[tuple[str, str, int]] = []  # (text path, image path, class id)
+        while (item := await classified_posts.get()) is not None:
+            t_path, class_name = item
+            if class_name is None:
+                results[t_path] = (False, "Text classification failed")
+                continue
+            try:
+                description_class_id = self.description_classifier.get_class_id(class_name)
+            except (IndexError, KeyError, TypeError):
+                self.log_text_exception(t_path, f"Unexpected class name: {class_name!r}")
+                results[t_path] = (False, "Unexpected class name")
+                continue
 
-        # 2 means no cat is on the image or there are multiple cats
-        if description_class_id != 2:
-            image_file_search_pattern = f"{images_path}/{Path(text_file_path).stem}*{self.dataset_manager.image_format}"
-            image_paths = glob(image_file_search_pattern)
+            # 2 means no cat is on the image or there are multiple cats
+            if description_class_id == 2:
+                results[t_path] = (False, "No cats mentioned or multiple cats mentioned")
+                continue
 
+            image_paths = images_by_post.get(Path(t_path).stem, [])
             if not image_paths:
-                return False, "No images found for this text"
+                results[t_path] = (False, "No images found for this text")
+                continue
 
-            processed_images = 0
-            for img_path in image_paths:
-                success = self.train_image_processor.process_training_image(img_path, description_class_id)
-                processed_images += int(success)
+            # Overwritten with OK as soon as one of the post images gets labeled
+            results[t_path] = (False, "Text classified, but no images were processed")
+            pending_images.extend((t_path, img_path, description_class_id) for img_path in image_paths)
+            if len(pending_images) >= self.yolo_batch_size:
+                await self.process_pending_images(pending_images, results)
+                pending_images = []
 
-            if processed_images == 0:
-                return False, "Text classified, but no images were processed"
-            return True, "OK"
-        else:
-            return False, "No cats mentioned or multiple cats mentioned"
+        if pending_images:
+            await self.process_pending_images(pending_images, results)
+        return results
 
-    def get_processed_text_file_names(self, labels_path: str):
+    async def process_pending_images(self, images: list[tuple[str, str, int]],
+                                     results: dict[str, tuple[bool, str]]):
+        try:
+            processed = await asyncio.to_thread(self.train_image_processor.process_training_images,
+                                                [img_path for _, img_path, _ in images],
+                                                [class_id for _, _, class_id in images], self.yolo_batch_size)
+        except Exception as e:
+            # Keep consuming: the producers are still classifying the remaining chunks
+            for t_path in {t_path for t_path, _, _ in images}:
+                self.log_text_exception(t_path, e)
+            return
+        for (t_path, _, _), success in zip(images, processed):
+            if success:
+                results[t_path] = (True, "OK")
+
+    async def process_classified_posts(self, class_names: dict[str, Optional[str]],
+                                       images_by_post: dict[str, list[str]]) -> dict[str, tuple[bool, str]]:
+        """Run image processing for posts whose class names are already known"""
+        classified_posts: asyncio.Queue = asyncio.Queue()
+        for item in class_names.items():
+            classified_posts.put_nowait(item)
+        classified_posts.put_nowait(None)
+        return await self.consume_classified_posts(classified_posts, images_by_post)
+
+    def index_images_by_post(self, images_path: str) -> dict[str, list[str]]:
+        """Map post id (text file stem) -> paths of its <post_id>_<idx> images, in one directory pass"""
+        image_format = self.dataset_manager.image_format
+        images_by_post = defaultdict(list)
+        for entry in os.scandir(images_path):
+            if entry.name.endswith(image_format):
+                images_by_post[entry.name[:-len(image_format)].rsplit('_', 1)[0]].append(entry.path)
+        return dict(images_by_post)
+
+    async def process_training_posts(self, text_file_paths: list[str], images_by_post: dict[str, list[str]],
+                                     rate_limit_delay=0.5) -> dict[str, tuple[bool, str]]:
+        """
+        Classify posts in chunks of llm_posts_per_request concurrently, paced by the RPM/TPM limiter.
+        Classified posts are queued to a single image-processing consumer, so YOLO inference overlaps
+        with the LLM requests still in flight. Returns text path -> (success, reason).
+        """
+        rate_limiter = RateLimiter.from_env()
+        classified_posts: asyncio.Queue = asyncio.Queue()
+        consumer = asyncio.create_task(self.consume_classified_posts(classified_posts, images_by_post))
+
+        chunk_size = self.llm_posts_per_request
+        tasks = [self.classify_posts_chunk(text_file_paths[i:i + chunk_size], classified_posts, rate_limiter,
+                                           rate_limit_delay)
+                 for i in range(0, len(text_file_paths), chunk_size)]
+        from tqdm.asyncio import tqdm_asyncio
+        await tqdm_asyncio.gather(*tasks, desc=f"Classifying text files in chunks of {chunk_size}")
+        await classified_posts.put(None)
+
+        return await consumer
+
+    def get_processed_text_file_names(self, labels_path: str) -> frozenset[str]:
         label_files = glob(f"{labels_path}/*.txt")
-        processed_text_files = []
-
-        for l_file in label_files:
-            text_file = self.image_path_to_text_path(l_file)
-            text_file_name = Path(text_file).name
-            processed_text_files.append(text_file_name)
-
-        return processed_text_files
+        return frozenset(os.path.basename(self.image_path_to_text_path(l_file)) for l_file in label_files)
 
     def parse_posts(self, group_id, posts_to_parse, max_posts_in_iteration=100, batch_delay=1.0) -> int:
         """Parse posts from a source and save them to the data directory using the configured post_parser."""
@@ -135,8 +306,11 @@ class ETL:
         return parsed_posts
 
     def process_training_data(self, sleep_time=0.5):
-        """Process all text files and create training items"""
-        data_path = Path(ROOT_DIR).parent / 'data'
+        """Process all text files and create training items.
+
+        sleep_time is the pause applied to all LLM requests after a 429 that carries no retry-after header.
+        """
+        data_path = DATA_DIR
         texts_path = str(data_path / 'texts')
         images_path = str(data_path / 'images')
         labels_path = str(data_path / 'labels')
@@ -148,14 +322,23 @@ class ETL:
         print(f"Found {len(text_file_paths)} text files to process")
         print(f"Already processed {len(processed_text_file_names)} text files")
         
-        for t_path in tqdm(text_file_paths, desc="Processing text files"):
-            success, reason = self.process_training_post(t_path, processed_text_file_names, images_path)
+        images_by_post = self.index_images_by_post(images_path)
+        pending = [t_path for t_path in text_file_paths if Path(t_path).name not in processed_text_file_names]
+        # One Langfuse span for the whole classification phase rather than one per request
+        try:
+            with self.description_classifier.classification_session(posts=len(pending)):
+                if self.use_batch_api and self.description_classifier.supports_batch_api:
+                    class_names = self.classify_with_batch_api(pending)
+                    results = asyncio.run(self.process_classified_posts(class_names, images_by_post))
+                else:
+                    results = asyncio.run(self.process_training_posts(pending, images_by_post,
+                                                                      rate_limit_delay=sleep_time))
+        finally:
+            self.flush_classes_log()
+        for t_path in text_file_paths:
+            success, reason = results.get(t_path, (False, "processed"))
             if not success:
                 skipped_text_files[reason].append(t_path)
-                continue
-            
-            if sleep_time > 0:
-                time.sleep(sleep_time)  # To avoid rate limiting with OpenAI API
 
         print(f"\nFinished processing text files.")
         for reason, files in skipped_text_files.items():
@@ -163,9 +346,6 @@ class ETL:
         
         with open('texts_skipped_log.json', 'w') as f:
             json.dump(skipped_text_files, f, indent=4)
-        
-        log_df = pd.DataFrame.from_records(self.classes_log)
-        log_df.to_csv(self.classes_log_name, index=False)
 
         stats = self.dataset_manager.organize_dataset()
         print(f"Dataset organized: {stats['train']} training, {stats['val']} validation, {stats['test']} test images")
@@ -185,10 +365,14 @@ class ETL:
                 batch_delay=batch_delay,
             )
             print(f"Successfully parsed {parsed_posts} posts from source")
+            # Release parser connections (HTTP pools, sessions) once parsing is done
+            if hasattr(self.post_parser, "close"):
+                self.post_parser.close()
         else:
             print("Post parser not initialized, skipping post parsing step")
 
         stats = self.process_training_data(sleep_time=sleep_time)
+        self.train_image_processor.close()
         # Ensure telemetry is flushed before exit in short-lived runs
         try:
             if hasattr(self.description_classifier, "flush_traces"):
@@ -0,0 +1,56 @@
+import os
+import asyncio
+import warnings
+from typing import Any, Coroutine, Optional
+
+import httpx
+
+
+class ImageDownloader:
+    """
+    Pooled HTTP client bound to its own event loop, shared by the parsers that fetch images over plain HTTP.
+
+    The loop and the keep-alive connections outlive single get_posts_batch calls; at most
+    `max_concurrent_downloads` requests are in flight. Call close() when done.
+    """
+
+    def __init__(self, max_concurrent_downloads: int = 32, http2: bool = False, retries: int = 0,
+                 headers: Optional[dict] = None):
+        self.max_concurrent_downloads = max_concurrent_downloads
+        self.loop = asyncio.new_event_loop()
+        self.http = httpx.AsyncClient(
+            headers=headers,
+            timeout=30,
+            follow_redirects=True,
+            transport=httpx.AsyncHTTPTransport(
+                http2=http2,
+                retries=retries,
+                limits=httpx.Limits(max_connections=max_concurrent_downloads, max_keepalive_connections=16),
+            ),
+        )
+        self._semaphore = asyncio.Semaphore(max_concurrent_downloads)
+
+    def run(self, coro: Coroutine) -> Any:
+        return self.loop.run_until_complete(coro)
+
+    async def download(self, url: str, img_path: str) -> bool:
+        """Stream a single image straight to img_path; returns whether an image was written"""
+        try:
+            async with self._semaphore:
+                async with self.http.stream("GET", url) as resp:
+                    if not (resp.is_success and resp.headers.get("Content-Type", "").startswith("image/")):
+                        return False
+                    with open(img_path, "wb") as f:
+                        async for chunk in resp.aiter_bytes(chunk_size=65536):
+                            f.write(chunk)
+            return True
+        except Exception as e:
+            warnings.warn(f"Failed to download image {url}: {e}")
+            if os.path.exists(img_path):
+                os.remove(img_path)
+            return False
+
+    def close(self) -> None:
+        if not self.loop.is_closed():
+            self.loop.run_until_complete(self.http.aclose())
+            self.loop.close()
@@ -0,0 +1,116 @@
+import os
+import re
+import time
+import asyncio
+from collections import deque
+from typing import Mapping, Optional
+
+
+class RateLimiter:
+    """
+    Proactive client-side limiter for LLM requests.
+
+    Keeps two sliding windows (requests and estimated tokens over the last `window` seconds) so we stay
+    under the provider RPM/TPM ceiling instead of discovering it through 429 responses. The number of
+    in-flight requests is tuned with AIMD: halved on every 429, increased by one after each
+    `increase_interval_ms` of clean responses.
+    """
+
+    def __init__(self, rpm_limit: int, tpm_limit: int, max_concurrency: int,
+                 increase_interval_ms: float = 2000, window: float = 60.0, poll_interval: float = 0.05):
+        self.rpm_limit = rpm_limit
+        self.tpm_limit = tpm_limit
+        self.max_concurrency = max_concurrency
+        self.concurrency = float(max_concurrency)
+        self.increase_interval_ms = increase_interval_ms
+        self.window = window
+        self.poll_interval = poll_interval
+
+        self._requests: deque[float] = deque()
+        self._tokens: deque[tuple[float, int]] = deque()
+        self._tokens_in_window = 0
+        self._in_flight = 0
+        self._paused_until = 0.0
+        self._last_adjust = time.monotonic()
+
+    @classmethod
+    def from_env(cls) -> "RateLimiter":
+        """Limiter configured from LLM_RPM_LIMIT, LLM_TPM_LIMIT and LLM_MAX_CONCURRENCY"""
+        return cls(rpm_limit=int(os.getenv('LLM_RPM_LIMIT', '500')),
+                   tpm_limit=int(os.getenv('LLM_TPM_LIMIT', '200000')),
+                   max_concurrency=int(os.getenv('LLM_MAX_CONCURRENCY', '16')))
+
+    def _evict(self, now: float) -> None:
+        while self._requests and now - self._requests[0] >= self.window:
+            self._requests.popleft()
+        while self._tokens and now - self._tokens[0][0] >= self.window:
+            _, tokens = self._tokens.popleft()
+            self._tokens_in_window -= tokens
+
+    def _wait_time(self, now: float, est_tokens: int) -> float:
+        wait = self._paused_until - now
+        if len(self._requests) >= self.rpm_limit:
+            wait = max(wait, self._requests[0] + self.window - now)
+        # A single request larger than the whole budget is let through once the window is empty
+        if self._tokens and self._tokens_in_window + est_tokens > self.tpm_limit:
+            wait = max(wait, self._tokens[0][0] + self.window - now)
+        return wait
+
+    async def acquire(self, est_tokens: int = 0) -> None:
+        """Wait until a request with `est_tokens` tokens fits into both windows and the concurrency limit"""
+        while True:
+            now = time.monotonic()
+            self._evict(now)
+            wait = self._wait_time(now, est_tokens)
+            if wait <= 0 and self._in_flight < int(self.concurrency):
+                self._in_flight += 1
+                self._requests.append(now)
+                self._tokens.append((now, est_tokens))
+                self._tokens_in_window += est_tokens
+                return
+            await asyncio.sleep(wait if wait > 0 else self.poll_interval)
+
+    def release(self) -> None:
+        self._in_flight -= 1
+
+    def on_success(self) -> None:
+        now = time.monotonic()
+        if (now - self._last_adjust) * 1000 >= self.increase_interval_ms:
+            self.concurrency = min(float(self.max_concurrency), self.concurrency + 1)
+            self._last_adjust = now
+
+    def on_rate_limited(self, retry_after: Optional[float] = None) -> None:
+        now = time.monotonic()
+        self.concurrency = max(1.0, self.concurrency * 0.5)
+        self._last_adjust = now
+        if retry_after:
+            self._paused_until = max(self._paused_until, now + retry_after)
+
+
+_DURATION_PART = re.compile(r"(\d+(?:\.\d+)?)(ms|s|m|h)")
+_DURATION_UNITS = {"ms": 0.001, "s": 1.0, "m": 60.0, "h": 3600.0}
+
+
+def parse_retry_after(headers: Optional[Mapping[str, str]]) -> Optional[float]:
+    """Extract the suggested delay in seconds from `retry-after*` or `x-ratelimit-reset-*` response headers"""
+    if not headers:
+        return None
+    if headers.get("retry-after-ms"):
+        try:
+            return float(headers["retry-after-ms"]) / 1000
+        except ValueError:
+            pass
+    if headers.get("retry-after"):
+        try:
+            return float(headers["retry-after"])
+        except ValueError:
+            pass
+    # OpenAI-style resets look like "1s", "250ms" or "6m0s"
+    resets = []
+    for name in ("x-ratelimit-reset-requests", "x-ratelimit-reset-tokens"):
+        value = headers.get(name)
+        if value:
+            parts = _DURATION_PART.findall(value)
+            if parts:
+                resets.append(sum(float(amount) * _DURATION_UNITS[unit] for amount, unit in parts))
+    return max(resets) if resets else None
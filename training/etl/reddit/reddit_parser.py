@@ -1,14 +1,18 @@
 import os
 import re
-import requests
-from pathlib import Path
-from typing import List, Optional
+import asyncio
+from itertools import islice
+from typing import TYPE_CHECKING, Iterator, List, Optional
 import warnings
-from tqdm import tqdm
 
-import praw
+from definitions import DATA_DIR, TEXTS_DIR, IMAGES_DIR
+from training.etl.image_downloader import ImageDownloader
 
-from definitions import ROOT_DIR
+if TYPE_CHECKING:
+    from tqdm import tqdm
+
+
+_IMG_EXT = re.compile(r"\.(png|jpe?g|webp)$", re.I)
 
 
 class RedditPostParser:
@@ -20,6 +24,10 @@ class RedditPostParser:
 
     Notes:
       - "group_id" is interpreted as subreddit name.
+      - parse_post is a coroutine; get_posts_batch downloads images of the whole batch concurrently
+        (at most `max_concurrent_downloads` requests in flight).
+      - One HTTP/2 client and event loop are kept for the parser's lifetime so connections to the
+        Reddit CDN are reused across batches; call close() when done.
       - Images and texts are saved under ../data/images and ../data/texts respectively.
       - The "token" arg is unused; kept for signature compatibility.
     """
@@ -42,6 +50,8 @@ class RedditPostParser:
                 "Missing Reddit credentials. Ensure REDDIT_CLIENT_ID, REDDIT_CLIENT_SECRET, and REDDIT_USER_AGENT are set."
             )
 
+        import praw
+
         # If username/password provided, use script (password) flow; otherwise use application-only (read-only)
         if login and password:
             self.reddit = praw.Reddit(
@@ -64,22 +74,27 @@ class RedditPostParser:
         self.max_posts_in_iteration = max_posts_in_iteration
         self.batch_delay = batch_delay
         self.user_agent = user_agent
+        self.max_concurrent_downloads = 32
+
+        # Pooled HTTP/2 connections to the Reddit CDN survive between get_posts_batch calls
+        self._downloader = ImageDownloader(self.max_concurrent_downloads, http2=True,
+                                           headers={"User-Agent": user_agent})
 
         # Ensure target directories exist
-        self.data_root = Path(ROOT_DIR).parent / "data"
-        self.texts_dir = self.data_root / "texts"
-        self.images_dir = self.data_root / "images"
+        self.data_root = DATA_DIR
+        self.texts_dir = TEXTS_DIR
+        self.images_dir = IMAGES_DIR
         self.texts_dir.mkdir(parents=True, exist_ok=True)
         self.images_dir.mkdir(parents=True, exist_ok=True)
 
     # --- helpers ---
     @staticmethod
-    def _clean_url(url: str) -> str:
+    def _clean_url(url: Optional[str]) -> Optional[str]:
         # Reddit often returns HTML-escaped urls
-        return re.sub(r"&amp;", "&", url)
+        return url.replace("&amp;", "&") if url else url
 
-    def _download_images_from_submission(self, submission) -> List[bytes]:
-        image_contents: List[bytes] = []
+    def _image_urls_from_submission(self, submission) -> List[str]:
+        urls: List[str] = []
 
         # Prefer galleries
         try:
@@ -93,40 +108,34 @@ class RedditPostParser:
                         if previews:
                             url = self._clean_url(previews[-1].get("u"))
                     if url:
-                        try:
-                            resp = requests.get(url, headers={"User-Agent": self.user_agent}, timeout=30)
-                            if resp.ok and resp.headers.get("Content-Type", "").startswith("image/"):
-                                image_contents.append(resp.content)
-                        except Exception:
-                            continue
-                return image_contents
+                        urls.append(url)
+                return urls
         except Exception as e:
             warnings.warn(f"Failed to parse gallery images for submission {getattr(submission, 'id', '?')}: {e}")
 
         # Direct image URL
-        if isinstance(submission.url, str) and re.search(r"\.(png|jpe?g|webp)$", submission.url, re.I):
-            try:
-                resp = requests.get(self._clean_url(submission.url), headers={"User-Agent": self.user_agent}, timeout=30)
-                if resp.ok and resp.headers.get("Content-Type", "").startswith("image/"):
-                    image_contents.append(resp.content)
-            except Exception as e:
-                warnings.warn(f"Failed to download direct image for submission {getattr(submission, 'id', '?')}: {e}")
+        if isinstance(submission.url, str) and _IMG_EXT.search(submission.url):
+            urls.append(self._clean_url(submission.url))
 
         # Preview fallback
         try:
             preview = getattr(submission, "preview", None)
             if preview and "images" in preview and preview["images"]:
-                url = self._clean_url(preview["images"][0]["source"]["url"])  # largest available
-                resp = requests.get(url, headers={"User-Agent": self.user_agent}, timeout=30)
-                if resp.ok and resp.headers.get("Content-Type", "").startswith("image/"):
-                    image_contents.append(resp.content)
+                urls.append(self._clean_url(preview["images"][0]["source"]["url"]))  # largest available
         except Exception as e:
-            warnings.warn(f"Failed to download preview image for submission {getattr(submission, 'id', '?')}: {e}")
+            warnings.warn(f"Failed to get preview image for submission {getattr(submission, 'id', '?')}: {e}")
 
-        return image_contents
+        return urls
+
+    async def _download_images_from_submission(self, submission, dest_prefix: str) -> int:
+        """Download all images of a submission to <dest_prefix>_<idx>.png; returns the number of images written"""
+        urls = self._image_urls_from_submission(submission)
+        written = await asyncio.gather(*[self._downloader.download(url, f"{dest_prefix}_{idx}.png")
+                                         for idx, url in enumerate(urls, start=1)])
+        return sum(written)
 
     # --- required contract ---
-    def parse_post(self, submission) -> None:
+    async def parse_post(self, submission) -> None:
         post_id = submission.id
         title = getattr(submission, "title", "") or ""
         selftext = getattr(submission, "selftext", "") or ""
@@ -134,19 +143,43 @@ class RedditPostParser:
 
         text_path = str(self.texts_dir / f"{post_id}.txt")
 
-        images = self._download_images_from_submission(submission)
-        if len(images) == 0:
+        images_written = await self._download_images_from_submission(submission, str(self.images_dir / post_id))
+        if images_written == 0:
             warnings.warn(f"Post '{post_id}' has no images. Skipping it")
             return None
 
-        for idx, img_bytes in enumerate(images, start=1):
-            img_path = text_path.replace("texts", "images").replace(".txt", f"_{idx}.png")
-            with open(img_path, "wb") as f:
-                f.write(img_bytes)
-
         with open(text_path, "w", encoding="utf-8") as f:
             f.write(text)
 
+    async def _parse_posts_worker(self, queue: asyncio.Queue, progress: 'tqdm') -> None:
+        while (submission := await queue.get()) is not None:
+            try:
+                await self.parse_post(submission)
+            except Exception as e:
+                warnings.warn(f"Failed to parse submission {getattr(submission, 'id', '?')}: {e}")
+            progress.update(1)
+
+    async def _parse_posts(self, submissions: Iterator, total: int, desc: str) -> int:
+        """
+        Pipeline the (blocking) PRAW listing with image downloads: submissions are pulled from the
+        listing in a worker thread and handed to download workers as soon as they arrive.
+        Returns the number of submissions taken from the listing.
+        """
+        from tqdm import tqdm
+
+        queue: asyncio.Queue = asyncio.Queue(maxsize=self.max_concurrent_downloads)
+        received = 0
+        with tqdm(total=total, desc=desc) as progress:
+            workers = [asyncio.create_task(self._parse_posts_worker(queue, progress))
+                       for _ in range(self.max_concurrent_downloads)]
+            while (submission := await asyncio.to_thread(next, submissions, None)) is not None:
+                await queue.put(submission)
+                received += 1
+            for _ in workers:
+                await queue.put(None)
+            await asyncio.gather(*workers)
+        return received
+
     def get_posts_batch(self, group_id, posts_to_parse, offset: int = 1) -> None:
         """
         Fetch a batch of posts from a subreddit and parse them.
@@ -165,21 +198,16 @@ class RedditPostParser:
         print(f"Texts will be stored in: {self.texts_dir}")
         print(f"Images will be stored in: {self.images_dir}")
 
-        # Grab more than we need to honor the offset
+        # Stream the listing instead of materializing it; skip the first 'offset' items
         limit = int(posts_to_parse) + int(offset)
-        submissions = list(subreddit.new(limit=limit))
-
-        if not submissions:
-            print("No items found from subreddit.new().")
-            return None
-
-        # Skip the first 'offset' items
-        to_process = submissions[offset:offset + posts_to_parse]
+        to_process = islice(subreddit.new(limit=limit), offset, offset + posts_to_parse)
         desc = (
             f"r/{group_id} -> texts: {self.texts_dir} | images: {self.images_dir} | "
             f"processing {posts_to_parse} posts"
         )
-        for submission in tqdm(to_process, desc=desc):
-            self.parse_post(submission)
-
+        if self._downloader.run(self._parse_posts(to_process, total=posts_to_parse, desc=desc)) == 0:
+            print("No items found from subreddit.new().")
+            return None
 
+    def close(self) -> None:
+        self._downloader.close()
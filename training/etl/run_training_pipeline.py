@@ -1,26 +1,37 @@
 import os
 import dotenv
 from pathlib import Path
-from definitions import ROOT_DIR, MODEL_PATH
-from ultralytics import YOLO
+from definitions import ROOT_DIR, DATA_DIR, MODEL_PATH
 
 
-def run_training_pipeline():
+def run_training_pipeline(dataset_ready=None, result_queue=None):
+    """
+    Train YOLO on the organized dataset.
+
+    When started in a background process, pass a multiprocessing Event as `dataset_ready`: the model is
+    loaded right away and training starts once the event is set. The model path is put into the
+    optional `result_queue`.
+    """
     # Load environment variables
     dotenv.load_dotenv(str(Path(ROOT_DIR) / '.env'))
 
     # Set up training parameters
-    data_yaml_path = str(Path(ROOT_DIR).parent / 'data' / 'data.yaml')
+    data_yaml_path = str(DATA_DIR / 'data.yaml')
     epochs = int(os.getenv('TRAINING_EPOCHS', '100'))
     batch_size = int(os.getenv('BATCH_SIZE', '16'))
     img_size = int(os.getenv('IMAGE_SIZE', '640'))
 
-    # Initialize model
+    # Initialize model (ultralytics is imported lazily: it pulls in torch)
+    from ultralytics import YOLO
     model = YOLO(MODEL_PATH)
 
+    if dataset_ready is not None:
+        print("Model loaded, waiting for the dataset to be ready...")
+        dataset_ready.wait()
+
     # Train the model
     print(f"Starting training with {data_yaml_path}...")
-    results = model.train(
+    train_metrics = model.train(
         data=data_yaml_path,
         epochs=epochs,
         batch=batch_size,
@@ -38,6 +49,8 @@ def run_training_pipeline():
     model.export(format='onnx')  # Export to ONNX format for deployment
     
     print(f"Training completed! Model saved to {model_path}")
+    if result_queue is not None:
+        result_queue.put(model_path)
     return model_path
 
 
@@ -1,15 +1,19 @@
 import os
 import re
-import io
+import asyncio
 import warnings
-from pathlib import Path
+from operator import attrgetter, itemgetter
+from collections import defaultdict
 from typing import List, Optional, Tuple
 
-from tqdm import tqdm
 from telethon import TelegramClient
 from telethon.tl.types import Message
 
-from definitions import ROOT_DIR
+from definitions import DATA_DIR, TEXTS_DIR, IMAGES_DIR
+
+_TME_HTTPS = re.compile(r"^https?://t\.me/", re.IGNORECASE)
+_TME = re.compile(r"^t\.me/", re.IGNORECASE)
+_id_getter = attrgetter("id")
 
 
 class TelegramPostParser:
@@ -26,6 +30,10 @@ class TelegramPostParser:
       - Requires environment variables TELEGRAM_API_ID and TELEGRAM_API_HASH.
         Optionally TELEGRAM_SESSION (path to session file, defaults to ".telegram_session").
       - Posts that contain any video are skipped entirely.
+      - parse_post is a coroutine; get_posts_batch enters the client's event loop once per batch and
+        downloads photos of all posts concurrently (at most `max_concurrent_downloads` at a time).
+      - The client connects once in __init__ and stays connected across batches; call close()
+        (or use the parser as a context manager) to disconnect.
     """
 
     def __init__(
@@ -48,14 +56,19 @@ class TelegramPostParser:
         # Create client; assumes session already authorized (first run may require interactive login)
         # We intentionally do not attempt interactive code requests here.
         self.client = TelegramClient(session=session_path, api_id=int(api_id), api_hash=api_hash)
+        # Connect and authorize once (start() prompts for login on a new session); the session is
+        # reused by every get_posts_batch call until close()
+        self.client.start()
 
         self.max_posts_in_iteration = max_posts_in_iteration
         self.batch_delay = batch_delay
+        self.max_concurrent_downloads = 8
+        self._download_semaphore = asyncio.Semaphore(self.max_concurrent_downloads)
 
         # Ensure target directories exist
-        self.data_root = Path(ROOT_DIR).parent / "data"
-        self.texts_dir = self.data_root / "texts"
-        self.images_dir = self.data_root / "images"
+        self.data_root = DATA_DIR
+        self.texts_dir = TEXTS_DIR
+        self.images_dir = IMAGES_DIR
         self.texts_dir.mkdir(parents=True, exist_ok=True)
         self.images_dir.mkdir(parents=True, exist_ok=True)
 
@@ -66,80 +79,80 @@ class TelegramPostParser:
             group_id = str(group_id)
         group_id = group_id.strip()
         # Accept forms like t.me/xxx, https://t.me/xxx, @xxx, or plain xxx
-        group_id = re.sub(r"^https?://t\.me/", "", group_id, flags=re.IGNORECASE)
-        group_id = re.sub(r"^t\.me/", "", group_id, flags=re.IGNORECASE)
-        group_id = re.sub(r"^@", "", group_id)
+        group_id = _TME_HTTPS.sub("", group_id)
+        group_id = _TME.sub("", group_id)
+        group_id = group_id.lstrip("@")
         return group_id
 
     @staticmethod
-    def _message_has_video(msg: Message) -> bool:
+    def _message_media_flags(msg: Message) -> Tuple[bool, bool]:
+        """Return (has_video, has_photo) for a message, inspecting its media attributes only once"""
         try:
-            if getattr(msg, "video", None):
-                return True
             doc = getattr(msg, "document", None)
-            if doc and getattr(doc, "mime_type", "").startswith("video"):
-                return True
-            # Video notes / round videos
-            if getattr(msg, "video_note", None):
-                return True
+            # Documents carry the media kind in the mime prefix ("video/..." or "image/...")
+            mime_prefix = (getattr(doc, "mime_type", None) or "")[:5] if doc else ""
+            # Video notes / round videos count as videos as well
+            has_video = bool(getattr(msg, "video", None) or getattr(msg, "video_note", None)) \
+                or mime_prefix == "video"
+            has_photo = bool(getattr(msg, "photo", None)) or mime_prefix == "image"
         except Exception:
-            return False
-        return False
-
-    @staticmethod
-    def _message_has_photo(msg: Message) -> bool:
+            return False, False
+        return has_video, has_photo
+
+    @classmethod
+    def _is_photo_post(cls, msgs: List[Message]) -> bool:
+        """A post is kept when none of its messages has a video and at least one has a photo"""
+        has_photo = False
+        for m in msgs:
+            m_video, m_photo = cls._message_media_flags(m)
+            if m_video:
+                return False
+            has_photo = has_photo or m_photo
+        return has_photo
+
+    async def _download_photo(self, msg: Message, img_path: str) -> bool:
+        """Stream the photo straight into img_path; partial files are removed on failure"""
         try:
-            if getattr(msg, "photo", None):
-                return True
-            # Some photos can be documents with image mimetype
-            doc = getattr(msg, "document", None)
-            if doc and getattr(doc, "mime_type", "").startswith("image"):
-                return True
+            async with self._download_semaphore:
+                # None means the message had no downloadable media and nothing was written
+                return await self.client.download_media(msg, file=img_path) is not None
         except Exception:
+            if os.path.exists(img_path):
+                os.remove(img_path)
             return False
-        return False
 
-    def _download_photo_bytes(self, msg: Message) -> Optional[bytes]:
-        try:
-            buffer = io.BytesIO()
-            self.client.loop.run_until_complete(self.client.download_media(msg, file=buffer))
-            return buffer.getvalue()
-        except Exception:
-            return None
+    @staticmethod
+    def _write_text(path: str, text: str) -> None:
+        with open(path, "w", encoding="utf-8") as f:
+            f.write(text)
 
     # --- required contract ---
-    def parse_post(self, item: Tuple[int, List[Message], str]) -> None:
+    async def parse_post(self, item: Tuple[int, List[Message], str]) -> None:
         """
         item is a tuple: (post_id, messages_in_group, combined_text)
         """
         post_id, messages, text = item
         text_path = str(self.texts_dir / f"{post_id}.txt")
 
-        # Collect image bytes from all messages in the group
-        image_bytes_list: List[bytes] = []
-        for msg in messages:
-            if self._message_has_photo(msg):
-                img_bytes = self._download_photo_bytes(msg)
-                if img_bytes:
-                    image_bytes_list.append(img_bytes)
+        # Download photos from all messages in the group concurrently, straight to their final paths
+        photo_messages = [msg for msg in messages if self._message_media_flags(msg)[1]]
+        img_paths = [text_path.replace("texts", "images").replace(".txt", f"_{idx}.png")
+                     for idx in range(1, len(photo_messages) + 1)]
+        downloads = await asyncio.gather(*[self._download_photo(msg, img_path)
+                                           for msg, img_path in zip(photo_messages, img_paths)])
 
-        if len(image_bytes_list) == 0:
+        if not any(downloads):
             warnings.warn(f"Post '{post_id}' has no images. Skipping it")
             return None
 
-        for idx, img_bytes in enumerate(image_bytes_list, start=1):
-            img_path = text_path.replace("texts", "images").replace(".txt", f"_{idx}.png")
-            with open(img_path, "wb") as f:
-                f.write(img_bytes)
-
-        with open(text_path, "w", encoding="utf-8") as f:
-            f.write(text)
+        # Written in a worker thread so a slow disk does not stall the downloads still running on the loop
+        await asyncio.to_thread(self._write_text, text_path, text)
 
     async def _fetch_messages(self, channel: str, limit: int) -> List[Message]:
+        # Expects the client connected in __init__
         messages: List[Message] = []
-        async with self.client:
-            async for msg in self.client.iter_messages(entity=channel, limit=limit):
-                messages.append(msg)
+        async for msg in self.client.iter_messages(entity=channel, limit=limit):
+            messages.append(msg)
         return messages
 
     def _group_messages_into_posts(self, messages: List[Message]) -> List[Tuple[int, List[Message], str]]:
@@ -150,56 +163,40 @@ class TelegramPostParser:
         - Combined text is caption/text from messages concatenated.
         - post_id is the smallest message.id in the group (stable for album).
         """
-        groups: dict[Optional[int], List[Message]] = {}
+        groups: defaultdict[int, List[Message]] = defaultdict(list)
         singles: List[Message] = []
         for msg in messages:
             gid = getattr(msg, "grouped_id", None)
             if gid:
-                groups.setdefault(gid, []).append(msg)
+                groups[gid].append(msg)
             else:
                 singles.append(msg)
 
         posts: List[Tuple[int, List[Message], str]] = []
 
-        # Album groups
+        # Album groups: skip posts with videos entirely, must contain at least one photo
         for gid, msgs in groups.items():
-            if any(self._message_has_video(m) for m in msgs):
-                # Skip posts with videos entirely
+            if not self._is_photo_post(msgs):
                 continue
-            # Must contain at least one photo
-            if not any(self._message_has_photo(m) for m in msgs):
-                continue
-            post_id = min(m.id for m in msgs)
+            post_id = min(msgs, key=_id_getter).id
             combined_text = "\n\n".join([m.message for m in msgs if (m.message or "").strip()])
             posts.append((post_id, msgs, combined_text))
 
         # Single messages
         for m in singles:
-            if self._message_has_video(m):
-                continue
-            if not self._message_has_photo(m):
+            if not self._is_photo_post([m]):
                 continue
             post_id = m.id
             text = (m.message or "").strip()
             posts.append((post_id, [m], text))
 
         # Keep original order (newest to oldest) based on post_id descending
-        posts.sort(key=lambda p: p[0], reverse=True)
+        posts.sort(key=itemgetter(0), reverse=True)
         return posts
 
-    def get_posts_batch(self, group_id, posts_to_parse, offset: int = 1) -> None:
-        channel = self._normalize_channel(group_id)
-
-        # Announce target storage directories
-        print(f"Texts will be stored in: {self.texts_dir}")
-        print(f"Images will be stored in: {self.images_dir}")
-
-        # We fetch more raw messages to honor offset and skipping rules
-        # Start with a generous limit; adjust if needed
-        raw_limit = int(posts_to_parse) + int(offset) + int(self.max_posts_in_iteration) * 2
-
+    async def _get_posts_batch_async(self, channel: str, posts_to_parse: int, offset: int, raw_limit: int) -> None:
         # Fetch messages (newest first)
-        messages = self.client.loop.run_until_complete(self._fetch_messages(channel=channel, limit=raw_limit))
+        messages = await self._fetch_messages(channel=channel, limit=raw_limit)
         if not messages:
             print("No items found from the channel.")
             return None
@@ -216,8 +213,33 @@ class TelegramPostParser:
             f"t.me/{channel} -> texts: {self.texts_dir} | images: {self.images_dir} | "
             f"processing {len(to_process)} posts"
         )
-        for post in tqdm(to_process, desc=desc):
-            self.parse_post(post)
+        from tqdm.asyncio import tqdm_asyncio
+
+        await tqdm_asyncio.gather(*[self.parse_post(post) for post in to_process], desc=desc)
+
+    def get_posts_batch(self, group_id, posts_to_parse, offset: int = 1) -> None:
+        channel = self._normalize_channel(group_id)
+
+        # Announce target storage directories
+        print(f"Texts will be stored in: {self.texts_dir}")
+        print(f"Images will be stored in: {self.images_dir}")
+
+        # We fetch more raw messages to honor offset and skipping rules
+        # Start with a generous limit; adjust if needed
+        raw_limit = int(posts_to_parse) + int(offset) + int(self.max_posts_in_iteration) * 2
+
+        # Telethon clients are bound to the loop they were created on, so run the batch there
+        self.client.loop.run_until_complete(
+            self._get_posts_batch_async(channel=channel, posts_to_parse=posts_to_parse, offset=offset,
+                                        raw_limit=raw_limit)
+        )
 
+    def close(self) -> None:
+        if self.client.is_connected():
+            self.client.loop.run_until_complete(self.client.disconnect())
 
+    def __enter__(self) -> "TelegramPostParser":
+        return self
 
+    def __exit__(self, exc_type, exc_value, traceback) -> None:
+        self.close()
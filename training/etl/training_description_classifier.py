@@ -1,11 +1,22 @@
-from typing import Literal
-from openai import OpenAI
+import json
+import time
+import warnings
+import asyncio
+from contextlib import contextmanager, nullcontext
+from typing import Literal, Optional
+from openai import OpenAI, AsyncOpenAI, APIConnectionError, APITimeoutError, InternalServerError, RateLimitError
+from tenacity import AsyncRetrying, retry_if_exception_type, stop_after_attempt, wait_random_exponential
 import dotenv
 import os
 dotenv.load_dotenv()
-from prompts import get_text_classifier_prompt
+from prompts import get_text_classifier_prompt, get_multi_post_classifier_prompt
 from langfuse import Langfuse
 from langfuse.openai import OpenAI as LangfuseOpenAI
+from langfuse.openai import AsyncOpenAI as LangfuseAsyncOpenAI
+from training.etl.rate_limiter import RateLimiter, parse_retry_after
+
+# Transient provider errors worth retrying: network blips, timeouts, 429 and 5xx
+RETRYABLE_LLM_ERRORS = (APIConnectionError, APITimeoutError, RateLimitError, InternalServerError)
 
 
 class DescriptionClassifier:
@@ -14,10 +25,14 @@ class DescriptionClassifier:
         print(f"Provider: {provider}")
         match provider:
             case "openai":
-                # Wrap OpenAI client so requests/usage are auto-tracked by Langfuse
+                # Wrap OpenAI clients so requests/usage are auto-tracked by Langfuse
                 self.client = LangfuseOpenAI()
+                # No SDK-level retries: the ETL rate limiter and tenacity own back-off, and must see every 429
+                self.async_client = LangfuseAsyncOpenAI(max_retries=0)
             case "deepseek":
                 self.client = OpenAI(api_key=os.getenv("DEEPSEEK_API_KEY"), base_url="https://api.deepseek.com")
+                self.async_client = AsyncOpenAI(api_key=os.getenv("DEEPSEEK_API_KEY"),
+                                                base_url="https://api.deepseek.com", max_retries=0)
             case _:
                 raise ValueError(f"\nLLM provider has to be openai or deepseek. Got '{provider}' instead")
         self.model_name = model_name
@@ -25,6 +40,15 @@ class DescriptionClassifier:
         self.language = language
         self.class_names_mapping = {"MALE CAT": 0, "FEMALE CAT": 1, "OTHER": 2}
         self.provider = provider
+        self._span_metadata = {"language": language, "provider": provider, "model": model_name}
+        # Set while classification_session is active: calls then report into this span instead of their own
+        self._session_span = None
+        self._session_count = 0
+
+    @property
+    def supports_batch_api(self) -> bool:
+        # DeepSeek exposes only the synchronous chat completions endpoint
+        return self.provider == "openai"
 
     def get_class_id(self, class_name_candidate) -> int:
         if class_name_candidate not in self.class_names_mapping:
@@ -35,32 +59,229 @@ class DescriptionClassifier:
                 return self.class_names_mapping[actual_class_names[0]]
         return self.class_names_mapping[class_name_candidate]
 
-    def classify_description(self, text: str):
+    def _build_messages(self, text: str) -> list[dict]:
         system_prompt = get_text_classifier_prompt(self.language)
-        # Use Langfuse OpenAI wrapper (auto-instrumentation). Also create a root span.
-        with self.langfuse.start_as_current_span(name="text_classification") as span:
-            # OpenTelemetry spans expose set_attribute(name, value)
+        return [
+            {"role": "system", "content": system_prompt},
+            {"role": "user", "content": text},
+        ]
+
+    def _build_multi_post_messages(self, texts: list[str]) -> list[dict]:
+        numbered_posts = "\n\n".join(f"### Post {idx}\n{text}" for idx, text in enumerate(texts, start=1))
+        return [
+            {"role": "system", "content": get_multi_post_classifier_prompt(self.language)},
+            {"role": "user", "content": numbered_posts},
+        ]
+
+    def _parse_multi_post_reply(self, reply: str, expected: int) -> list[str]:
+        start, end = reply.find("["), reply.rfind("]")
+        if start == -1 or end < start:
+            raise ValueError(f"Expected a JSON array of labels, got: {reply!r}")
+        labels = json.loads(reply[start:end + 1])
+        if not isinstance(labels, list) or len(labels) != expected:
+            raise ValueError(f"Expected {expected} labels, got: {reply!r}")
+        if not all(isinstance(label, str) and label in self.class_names_mapping for label in labels):
+            raise ValueError(f"Expected labels from {list(self.class_names_mapping)}, got: {reply!r}")
+        return labels
+
+    @contextmanager
+    def classification_session(self, name: str = "classification_session", **metadata):
+        """
+        Group all classifications made inside the block under one Langfuse span instead of a span per call.
+        Each result is recorded as an event of the session span; the total count is set when the block exits.
+        """
+        with self.langfuse.start_as_current_span(name=name, metadata={**self._span_metadata, **metadata}) as span:
+            self._session_span, self._session_count = span, 0
             try:
-                span.set_attribute("language", self.language)
-                span.set_attribute("provider", self.provider)
-                span.set_attribute("model", self.model_name)
-            except Exception:
-                pass
+                yield span
+            finally:
+                self._session_span = None
+                self._trace(span.update, metadata={"count": self._session_count})
+
+    @staticmethod
+    def _trace(method, **kwargs):
+        # Tracing problems must never fail a classification
+        try:
+            method(**kwargs)
+        except Exception as e:
+            warnings.warn(f"Failed to record Langfuse trace data: {e}")
+
+    def _classification_span(self, count: int = 1):
+        if self._session_span is not None:
+            return nullcontext(self._session_span)
+        return self.langfuse.start_as_current_span(name="text_classification",
+                                                   metadata={**self._span_metadata, "count": count})
+
+    def _record_result(self, span, result, count: int = 1):
+        """Add a result event to the active session span, or set it as the output of a standalone span"""
+        if span is not None and span is self._session_span:
+            self._session_count += count
+            self._trace(span.create_event, name="text_classification", output=result, metadata={"count": count})
+        elif span is not None:
+            self._trace(span.update, output=result)
+
+    def classify_description(self, text: str):
+        # Use Langfuse OpenAI wrapper (auto-instrumentation). Also create a root span outside of a session.
+        with self._classification_span() as span:
             completion = self.client.chat.completions.create(
                 model=self.model_name,
                 temperature=self.temperature,
-                messages=[
-                    {"role": "system", "content": system_prompt},
-                    {"role": "user", "content": text},
-                ],
+                messages=self._build_messages(text),
             )
             result = completion.choices[0].message.content
-            try:
-                span.set_attribute("result", result)
-            except Exception:
-                pass
+            self._record_result(span, result)
             return result
 
+    async def classify_description_async(self, text: str):
+        """Async counterpart of classify_description, so many posts can be classified concurrently."""
+        with self._classification_span() as span:
+            completion = await self.async_client.chat.completions.create(
+                model=self.model_name,
+                temperature=self.temperature,
+                messages=self._build_messages(text),
+            )
+            result = completion.choices[0].message.content
+            self._record_result(span, result)
+            return result
+
+    def classify_many(self, texts: list[str]) -> list[str]:
+        """Classify several posts in a single request; labels are returned in input order."""
+        with self._classification_span(len(texts)) as span:
+            completion = self.client.chat.completions.create(
+                model=self.model_name,
+                temperature=self.temperature,
+                messages=self._build_multi_post_messages(texts),
+            )
+            results = self._parse_multi_post_reply(completion.choices[0].message.content, len(texts))
+            self._record_result(span, results, len(results))
+            return results
+
+    async def classify_many_async(self, texts: list[str]) -> list[str]:
+        """Async counterpart of classify_many."""
+        with self._classification_span(len(texts)) as span:
+            completion = await self.async_client.chat.completions.create(
+                model=self.model_name,
+                temperature=self.temperature,
+                messages=self._build_multi_post_messages(texts),
+            )
+            results = self._parse_multi_post_reply(completion.choices[0].message.content, len(texts))
+            self._record_result(span, results, len(results))
+            return results
+
+    def classify_batch(self, texts: list[str], poll_interval: float = 30.0) -> list[Optional[str]]:
+        """Classify texts offline through the provider Batch API.
+
+        Cheaper than synchronous calls and not subject to RPM limits, but results may take up to 24h.
+        Results are returned in input order; None marks items the batch failed to classify.
+        """
+        if not self.supports_batch_api:
+            raise ValueError(f"Batch API is not supported for provider '{self.provider}'")
+        if not texts:
+            return []
+
+        requests_jsonl = "\n".join(
+            json.dumps({
+                "custom_id": str(idx),
+                "method": "POST",
+                "url": "/v1/chat/completions",
+                "body": {
+                    "model": self.model_name,
+                    "temperature": self.temperature,
+                    "messages": self._build_messages(text),
+                },
+            }, ensure_ascii=False)
+            for idx, text in enumerate(texts)
+        )
+        batch_input = self.client.files.create(file=("classification_batch.jsonl", requests_jsonl.encode("utf-8")),
+                                               purpose="batch")
+        batch = self.client.batches.create(input_file_id=batch_input.id, endpoint="/v1/chat/completions",
+                                           completion_window="24h")
+        print(f"Submitted batch {batch.id} with {len(texts)} texts")
+        while batch.status not in ("completed", "failed", "expired", "cancelled"):
+            time.sleep(poll_interval)
+            batch = self.client.batches.retrieve(batch.id)
+
+        results: list[Optional[str]] = [None] * len(texts)
+        if batch.status != "completed" or not batch.output_file_id:
+            print(f"Batch {batch.id} finished with status '{batch.status}'")
+            return results
+
+        output = self.client.files.content(batch.output_file_id).text
+        for line in output.splitlines():
+            if not line.strip():
+                continue
+            item = json.loads(line)
+            response = item.get("response") or {}
+            if response.get("status_code") == 200:
+                results[int(item["custom_id"])] = response["body"]["choices"][0]["message"]["content"]
+        for result in results:
+            self._record_result(self._session_span, result)
+        return results
+
+    async def classify_with_limits(self, texts: list[str], rate_limiter: RateLimiter, max_attempts: int = 4,
+                                   rate_limit_delay: float = 0.5) -> list[str]:
+        """
+        Classify one text (classify_description_async) or several in one request (classify_many_async),
+        paced by rate_limiter and retried on transient errors. rate_limit_delay is the pause applied after
+        a 429 that carries no retry-after header.
+        """
+        async for attempt in AsyncRetrying(stop=stop_after_attempt(max_attempts),
+                                           wait=wait_random_exponential(multiplier=1, max=30),
+                                           retry=retry_if_exception_type(RETRYABLE_LLM_ERRORS),
+                                           reraise=True):
+            with attempt:
+                class_names = await self._request_with_limiter(texts, rate_limiter, rate_limit_delay)
+        return class_names
+
+    async def _request_with_limiter(self, texts: list[str], rate_limiter: RateLimiter,
+                                    rate_limit_delay: float) -> list[str]:
+        # Rough token estimate: ~4 characters per token
+        await rate_limiter.acquire(est_tokens=sum(len(text) for text in texts) // 4)
+        try:
+            if len(texts) == 1:
+                class_names = [await self.classify_description_async(texts[0])]
+            else:
+                class_names = await self.classify_many_async(texts)
+            rate_limiter.on_success()
+            return class_names
+        except RateLimitError as e:
+            retry_after = parse_retry_after(getattr(e.response, 'headers', None))
+            rate_limiter.on_rate_limited(retry_after or rate_limit_delay)
+            raise
+        finally:
+            rate_limiter.release()
+
+    async def _classify_each(self, texts: list[str], rate_limiter: RateLimiter) -> list[Optional[str]]:
+        async def classify(text: str) -> Optional[str]:
+            try:
+                return (await self.classify_with_limits([text], rate_limiter))[0]
+            except Exception as e:
+                print(f"Text classification failed: {e}")
+                return None
+
+        return await asyncio.gather(*[classify(text) for text in texts])
+
+    def classify_descriptions(self, texts: list[str], batch_threshold: int = 32,
+                              rate_limiter: Optional[RateLimiter] = None) -> list[int]:
+        """Classify texts into class ids, routing more than batch_threshold texts through the Batch API.
+
+        Otherwise texts are classified concurrently, one request per text, paced by rate_limiter
+        (RateLimiter.from_env() by default) and retried on transient errors. Synchronous: must not be called
+        from a running event loop. Texts that could not be classified get the OTHER class id.
+        """
+        if len(texts) > batch_threshold and self.supports_batch_api:
+            class_names = self.classify_batch(texts)
+        else:
+            class_names = asyncio.run(self._classify_each(texts, rate_limiter or RateLimiter.from_env()))
+
+        class_ids = []
+        for class_name in class_names:
+            try:
+                class_ids.append(self.get_class_id(class_name))
+            except (IndexError, TypeError):
+                class_ids.append(self.class_names_mapping['OTHER'])
+        return class_ids
+
     def flush_traces(self):
         try:
             self.langfuse.flush()
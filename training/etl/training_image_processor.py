@@ -1,18 +1,40 @@
 import os
+import time
+import threading
 import cv2
+import numpy as np
 import supervision as sv
+from concurrent.futures import ThreadPoolExecutor, as_completed
 from pathlib import Path
-from ultralytics import YOLO
-from definitions import ROOT_DIR,  EXCEPTIONS_FILE_NAME
+from definitions import EXCEPTIONS_FILE_NAME, LABELS_DIR
+
+LABEL_ROW_FORMAT = ['%d', '%.6f', '%.6f', '%.6f', '%.6f']
+# Bump when the content of label files changes. Version 1 files (no marker) were written with the x and y
+# axes of the xyxy boxes swapped, so they are moved aside and regenerated.
+LABEL_FORMAT_VERSION = '2'
+LABEL_FORMAT_MARKER = '.label_format'
 
 
 class TrainingImageProcessor:
     def __init__(self, model_path, conf=0.5, verbose=False):
         self.exceptions_file_name = EXCEPTIONS_FILE_NAME
         self.model_path = model_path
-        self.model = YOLO(self.model_path)
+        # Deferred: importing ultralytics pulls in torch, which dominates start-up time
+        from ultralytics import YOLO
+        self.model = YOLO(self.resolve_model_path(self.model_path), task='detect')
+        # Ultralytics predictors are not thread-safe; only the forward pass is serialized
+        self._model_lock = threading.RLock()
         self.confidence = conf
         self.verbose = verbose
+        # Files above this size are decoded at half resolution; YOLO resizes to 640 px anyway
+        self.reduced_read_min_bytes = 2 * 1024 * 1024
+        # Created once here rather than per labeled image
+        self.labels_folder_path = LABELS_DIR
+        self.labels_folder_path.mkdir(parents=True, exist_ok=True)
+        self.retire_outdated_labels()
+        self._labels_dir_fd = None
+        if os.open in os.supports_dir_fd and hasattr(os, 'O_DIRECTORY'):
+            self._labels_dir_fd = os.open(str(self.labels_folder_path), os.O_RDONLY | os.O_DIRECTORY)
         self.category_dict = {
             0: 'person', 1: 'bicycle', 2: 'car', 3: 'motorcycle', 4: 'airplane', 5: 'bus',
             6: 'train', 7: 'truck', 8: 'boat', 9: 'traffic light', 10: 'fire hydrant',
@@ -32,64 +54,172 @@ class TrainingImageProcessor:
             77: 'teddy bear', 78: 'hair drier', 79: 'toothbrush'
         }
 
+    def retire_outdated_labels(self):
+        """
+        Move label files written in an older LABEL_FORMAT_VERSION to labels_legacy_<version>_<timestamp>, so the ETL
+        treats their posts as unprocessed and labels them again instead of mixing both formats.
+        """
+        marker_path = self.labels_folder_path / LABEL_FORMAT_MARKER
+        version = marker_path.read_text().strip() if marker_path.exists() else '1'
+        if version == LABEL_FORMAT_VERSION:
+            return
+        if any(entry.name.endswith('.txt') for entry in os.scandir(self.labels_folder_path)):
+            legacy_path = self.labels_folder_path.with_name(f"labels_legacy_{version}_{int(time.time())}")
+            os.rename(self.labels_folder_path, legacy_path)
+            self.labels_folder_path.mkdir(parents=True)
+            print(f"Labels in format version {version} moved to {legacy_path}; they will be regenerated")
+        marker_path.write_text(LABEL_FORMAT_VERSION)
+
+    @staticmethod
+    def resolve_model_path(model_path) -> str:
+        """Prefer a TensorRT engine exported next to the .pt weights when a CUDA device is available"""
+        engine_path = Path(model_path).with_suffix('.engine')
+        if engine_path.exists():
+            import torch
+            if torch.cuda.is_available():
+                return str(engine_path)
+        return str(model_path)
+
+    @staticmethod
+    def export_tensorrt_engine(model_path, imgsz=640, batch=16, int8=False, data=None) -> str:
+        """
+        One-time offline export of the .pt weights into a FP16 TensorRT engine next to them. With int8=True
+        the engine is INT8-quantized, calibrated on the `data` dataset yaml. The engine accepts dynamic batches
+        up to `batch` images, so it covers the batched inference in process_training_images.
+        """
+        from ultralytics import YOLO
+        return YOLO(model_path).export(format='engine', imgsz=imgsz, half=not int8, int8=int8, data=data,
+                                       dynamic=True, batch=batch)
+
+    def read_image(self, image_path):
+        """Read an image, letting the decoder downscale large files by 2x (labels are normalized by image size)"""
+        try:
+            reduce = os.path.getsize(image_path) > self.reduced_read_min_bytes
+        except OSError:
+            return None
+        return cv2.imread(image_path, cv2.IMREAD_REDUCED_COLOR_2 if reduce else cv2.IMREAD_COLOR)
+
     def detect_objects(self, image):
-        results = self.model(source=image, conf=self.confidence, verbose=self.verbose)[0]
+        with self._model_lock:
+            results = self.model(source=image, conf=self.confidence, verbose=self.verbose)[0]
         detections = sv.Detections.from_ultralytics(results)
         return detections
 
     @staticmethod
-    def detections_to_yolo_format(detections, img_h, img_w) -> list[tuple]:
-        yolo_coords = []
-        for coords in detections.xyxy:
-            ymin, xmin, ymax, xmax = coords.tolist()
-            box_height = (ymax - ymin) / img_h
-            box_width = (xmax - xmin) / img_w
-            center_x = (xmin + (xmax - xmin) / 2) / img_w  # Fixed calculation
-            center_y = (ymin + (ymax - ymin) / 2) / img_h  # Fixed calculation
-            yolo_coords.append((center_x, center_y, box_width, box_height))
-        return yolo_coords
+    def detections_to_yolo_format(detections, img_h, img_w) -> np.ndarray:
+        """Convert (N, 4) xyxy pixel boxes into (N, 4) normalized (center_x, center_y, width, height) rows"""
+        xyxy = np.asarray(detections.xyxy, dtype=np.float32).reshape(-1, 4)
+        xmin, ymin, xmax, ymax = xyxy[:, 0], xyxy[:, 1], xyxy[:, 2], xyxy[:, 3]
+        center_x = (xmin + xmax) * 0.5 / img_w
+        center_y = (ymin + ymax) * 0.5 / img_h
+        box_width = (xmax - xmin) / img_w
+        box_height = (ymax - ymin) / img_h
+        return np.stack([center_x, center_y, box_width, box_height], axis=1)
 
-    @staticmethod
-    def write_detections_to_labels_file(yolo_detections, gt_labels, image_path):
-        labels_folder_path = Path(ROOT_DIR).parent / 'data' / 'labels'
-        os.makedirs(str(labels_folder_path), exist_ok=True)
-        label_file_path = str(labels_folder_path / Path(image_path).name.replace('.png', '.txt'))
-        with open(label_file_path, 'w') as f:
-            for image_coords, image_label in zip(yolo_detections, gt_labels):
-                f.write(f"{image_label} {' '.join([str(c) for c in image_coords])}\n")
+    def write_detections_to_labels_file(self, yolo_detections, gt_labels, image_path):
+        label_file_name = Path(image_path).stem + '.txt'
+        # (N, 5) rows of class id + box, formatted by NumPy instead of per-float Python formatting
+        rows = np.column_stack([np.asarray(gt_labels, dtype=np.float64).reshape(-1, 1),
+                                np.asarray(yolo_detections, dtype=np.float64).reshape(-1, 4)])
+        if self._labels_dir_fd is not None:
+            # Resolve the file relative to the already open labels directory
+            fd = os.open(label_file_name, os.O_WRONLY | os.O_CREAT | os.O_TRUNC, 0o644, dir_fd=self._labels_dir_fd)
+        else:
+            fd = os.open(str(self.labels_folder_path / label_file_name), os.O_WRONLY | os.O_CREAT | os.O_TRUNC, 0o644)
+        with os.fdopen(fd, 'w') as f:
+            np.savetxt(f, rows, fmt=LABEL_ROW_FORMAT)
+
+    def close(self):
+        if self._labels_dir_fd is not None:
+            os.close(self._labels_dir_fd)
+            self._labels_dir_fd = None
+
+    def log_image_exception(self, image_path, message):
+        with open(self.exceptions_file_name, 'a') as f:
+            f.write(f"Image path: {image_path}. Error: {message}\n")
+
+    def label_detections(self, image_path, image, detections, label) -> bool:
+        """Write the label file for an image with exactly one detected cat"""
+        # Filter detections to cat class if available; fall back to any detection
+        try:
+            cat_detections = detections[detections.class_id == 15]
+        except Exception:
+            cat_detections = detections
+
+        if len(cat_detections) == 0:
+            self.log_image_exception(image_path, "No cats detected")
+            return False
+
+        img_height, img_width = image.shape[:2]  # Fixed order
+        yolo_detections = self.detections_to_yolo_format(cat_detections, img_height, img_width)
+
+        if len(yolo_detections) > 1:
+            self.log_image_exception(image_path, "More than 1 cat detected. Skipping")
+            return False
+
+        self.write_detections_to_labels_file(yolo_detections, [label], image_path)
+        return True
 
     def process_training_image(self, image_path, label) -> bool:
         try:
-            image = cv2.imread(image_path)
+            image = self.read_image(image_path)
             if image is None:
-                with open(self.exceptions_file_name, 'a') as f:
-                    f.write(f"Image path: {image_path}. Error: Could not read image file\n")
+                self.log_image_exception(image_path, "Could not read image file")
                 return False
                 
             detections = self.detect_objects(image)
-            # Filter detections to cat class if available; fall back to any detection
-            try:
-                cat_detections = detections[detections.class_id == 15]
-            except Exception:
-                cat_detections = detections
-            
-            if len(cat_detections) == 0:
-                with open(self.exceptions_file_name, 'a') as f:
-                    f.write(f"Image path: {image_path}. Error: No cats detected\n")
-                return False
-                
-            img_height, img_width = image.shape[:2]  # Fixed order
-            yolo_detections = self.detections_to_yolo_format(cat_detections, img_height, img_width)
-            
-            if len(yolo_detections) > 1:
-                with open(self.exceptions_file_name, 'a') as f:
-                    f.write(f"Image path: {image_path}. Error: More than 1 cat detected. Skipping\n")
-                return False
-            
-            self.write_detections_to_labels_file(yolo_detections, [label], image_path)
-            return True
+            return self.label_detections(image_path, image, detections, label)
             
         except Exception as e:
-            with open(self.exceptions_file_name, 'a') as f:
-                f.write(f"Image path: {image_path}. Error: {str(e)}\n")
+            self.log_image_exception(image_path, str(e))
             return False
+
+    def process_training_images(self, image_paths: list[str], labels: list[int], batch_size=16) -> list[bool]:
+        """
+        Label images with YOLO running on up to batch_size images per forward pass. Images are read by a
+        thread pool (decoding releases the GIL) and inference runs without autograd bookkeeping.
+        """
+        import torch
+
+        processed = [False] * len(image_paths)
+        with ThreadPoolExecutor(max_workers=os.cpu_count()) as pool, torch.inference_mode():
+            for start in range(0, len(image_paths), batch_size):
+                batch_paths = image_paths[start:start + batch_size]
+                try:
+                    images = list(pool.map(self.read_image, batch_paths))
+                    readable = []
+                    for idx, image in enumerate(images):
+                        if image is None:
+                            self.log_image_exception(batch_paths[idx], "Could not read image file")
+                        else:
+                            readable.append(idx)
+
+                    if not readable:
+                        continue
+                    with self._model_lock:
+                        results = self.model(source=[images[idx] for idx in readable], conf=self.confidence,
+                                             verbose=self.verbose)
+                    for idx, result in zip(readable, results):
+                        try:
+                            detections = sv.Detections.from_ultralytics(result)
+                            processed[start + idx] = self.label_detections(batch_paths[idx], images[idx],
+                                                                           detections, labels[start + idx])
+                        except Exception as e:
+                            self.log_image_exception(batch_paths[idx], str(e))
+                except Exception as e:
+                    for image_path in batch_paths:
+                        self.log_image_exception(image_path, str(e))
+        return processed
+
+    def process_training_images_threaded(self, items: list[tuple[str, int]], workers=8) -> list[bool]:
+        """
+        Label (image path, label) items one image per task on a thread pool: reading, box conversion
+        and label writing overlap across workers while forward passes take turns on the model lock.
+        """
+        processed = [False] * len(items)
+        with ThreadPoolExecutor(max_workers=workers) as pool:
+            futures = {pool.submit(self.process_training_image, image_path, label): idx
+                       for idx, (image_path, label) in enumerate(items)}
+            for future in as_completed(futures):
+                processed[futures[future]] = future.result()
+        return processed
@@ -1,10 +1,9 @@
 import vk_api
 import os
-import requests
-from tqdm import tqdm
-from pathlib import Path
+import asyncio
 import warnings
-from definitions import ROOT_DIR
+from definitions import TEXTS_DIR, IMAGES_DIR
+from training.etl.image_downloader import ImageDownloader
 import time
 
 
@@ -14,6 +13,12 @@ class VKPostParser:
         self.api = vk_session.get_api()
         self.max_posts_in_iteration = max_posts_in_iteration
         self.batch_delay = batch_delay
+        self.max_concurrent_downloads = 32
+
+        # Pooled keep-alive connections survive between get_posts_batch calls; failed connects are retried
+        self._downloader = ImageDownloader(self.max_concurrent_downloads, retries=3)
+        TEXTS_DIR.mkdir(parents=True, exist_ok=True)
+        IMAGES_DIR.mkdir(parents=True, exist_ok=True)
 
     def get_photo_from_attach(self, attach: dict):
         match attach['type']:
@@ -24,25 +29,23 @@ class VKPostParser:
             case _:
                 return None
 
-    def parse_post(self, item: dict):
+    async def parse_post(self, item: dict):
         post_id = item['id']
         text = item['text']
-        text_path = str(Path(ROOT_DIR).parent / 'texts' / f'{post_id}.txt')
-        images = []
+        text_path = str(TEXTS_DIR / f'{post_id}.txt')
+        urls = []
         for i, attach in enumerate(item['attachments']):
             img_dict = self.get_photo_from_attach(attach)
             if img_dict is None:
                 continue
-            result = requests.get(img_dict['sizes'][-1]['url'])
-            images.append(result)
-        if len(images) == 0:
+            urls.append(img_dict['sizes'][-1]['url'])
+        written = await asyncio.gather(*[
+            self._downloader.download(url, str(IMAGES_DIR / f'{post_id}_{i + 1}.png'))
+            for i, url in enumerate(urls)])
+        if not any(written):
             warnings.warn(f"Post '{post_id}' has no images. Skipping it")
             return None
 
-        for i, img in enumerate(images):
-            img_path = text_path.replace('text', 'image').replace('.txt', f'_{i + 1}.png')
-            with open(img_path, 'wb') as f:
-                f.write(img.content)
         with open(text_path, 'w', encoding='utf-8') as f:
             f.write(text)
 
@@ -56,16 +59,29 @@ class VKPostParser:
         if not response['items']:
             print(f"No items found. Response:\n{response}")
             return None
-        texts_dir = Path(ROOT_DIR).parent / 'texts'
-        images_dir = Path(ROOT_DIR).parent / 'images'
-        print(f"Texts will be stored in: {texts_dir}")
-        print(f"Images will be stored in: {images_dir}")
+        print(f"Texts will be stored in: {TEXTS_DIR}")
+        print(f"Images will be stored in: {IMAGES_DIR}")
+
+        self._downloader.run(self.parse_posts(response['items'],
+                                              desc=f"Processing requested {posts_to_parse} posts to texts: {TEXTS_DIR} images: {IMAGES_DIR}..."))
+
+    async def parse_posts(self, items: list, desc: str):
+        # At most max_concurrent_downloads requests in flight to respect VK limits
+        from tqdm.asyncio import tqdm_asyncio
+
+        await tqdm_asyncio.gather(*[self.parse_post(item) for item in items], desc=desc)
 
-        for item in tqdm(response['items'], desc=f"Processing requested {posts_to_parse} posts to texts: {texts_dir} images: {images_dir}..."):
-            self.parse_post(item)
+    def close(self) -> None:
+        self._downloader.close()
 
 
 if __name__ == "__main__":
+    # uvloop is optional (not available on Windows); the parser loop is created from the policy
+    try:
+        import uvloop
+        asyncio.set_event_loop_policy(uvloop.EventLoopPolicy())
+    except ImportError:
+        pass
     POSTS_TO_PARSE, MAX_POSTS_IN_ITERATION = int(os.getenv('POSTS_TO_PARSE')), int(os.getenv('MAX_POSTS_IN_ITERATION'))
     GROUP_ID, BATCH_DELAY = int(os.getenv('GROUP_ID')), float(os.getenv('BATCH_DELAY'))
     vk_posts_parser = VKPostParser(os.getenv('VK_LOGIN'), os.getenv('VK_PASSWORD'), os.getenv('VK_TOKEN'),
@@ -80,3 +96,4 @@ if __name__ == "__main__":
                                         offset=parsed_posts)
         parsed_posts += current_posts_to_parse
         time.sleep(BATCH_DELAY)
+    vk_posts_parser.close()
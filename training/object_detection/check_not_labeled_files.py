@@ -1,12 +1,11 @@
-from glob import glob
-from pathlib import Path
-from definitions import ROOT_DIR
+import os
+from definitions import IMAGES_DIR, LABELS_DIR
 
 if __name__ == "__main__":
-    label_root = str(Path(ROOT_DIR).parent / 'data' / 'labels')
-    image_root = str(Path(ROOT_DIR).parent / 'data' / 'images')
-    label_pathes = [Path(elem).name.replace('.txt', '') for elem in glob(label_root + '/*.txt')]
-    image_pathes = [Path(elem).name.replace('.png', '') for elem in glob(image_root + '/*.png')]
-    print(f"\nFound {len(image_pathes)} images and {len(label_pathes)} labels. Comparing...")
-    print(f"\nThere are {len(set(image_pathes) - set(label_pathes))} unique images and {len(set(label_pathes) - set(image_pathes))} unique labels")
-    print(f"\nExamples: {image_pathes[0]}, {label_pathes[0]}")
+    label_root = str(LABELS_DIR)
+    image_root = str(IMAGES_DIR)
+    label_stems = frozenset(e.name[:-4] for e in os.scandir(label_root) if e.name.endswith('.txt'))
+    image_stems = frozenset(e.name[:-4] for e in os.scandir(image_root) if e.name.endswith('.png'))
+    print(f"\nFound {len(image_stems)} images and {len(label_stems)} labels. Comparing...")
+    print(f"\nThere are {len(image_stems - label_stems)} unique images and {len(label_stems - image_stems)} unique labels")
+    print(f"\nExamples: {next(iter(image_stems), None)}, {next(iter(label_stems), None)}")